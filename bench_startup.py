@@ -0,0 +1,80 @@
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from shared_dataset import DATASET_DIR, publish_dataset
+
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+# One headless run of a dashboard script up to its first page, in a fresh
+# interpreter: streamlit and the script's imports, its loading and every
+# st.plotly_chart of the default view
+FIRST_PAGE = """
+import time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({script!r}, default_timeout=600).run()
+assert not app.exception, [e.value for e in app.exception]
+assert len(app.get('plotly_chart')) == 4
+print(time.perf_counter() - start)
+"""
+
+
+def run(tree, cwd, repeat):
+    """ (in-process times, wall times including interpreter start-up) of tree's run.py """
+    code = FIRST_PAGE.format(script=os.path.join(tree, 'run.py'))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [tree, os.environ.get('PYTHONPATH')])))
+    inner, wall = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env,
+                             capture_output=True, text=True, check=True)
+        wall.append(time.perf_counter() - start)
+        inner.append(float(out.stdout.strip().splitlines()[-1]))
+    return inner, wall
+
+
+def checkout(revision, path):
+    """ the tree of a git revision, to time the dashboard as it was """
+    os.makedirs(path)
+    archive = subprocess.run(['git', 'archive', revision], cwd=REPO,
+                             capture_output=True, check=True).stdout
+    subprocess.run(['tar', '-x', '-C', path], input=archive, check=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the dashboard cold start against a baseline revision')
+    parser.add_argument('--data', default='df_all.csv')
+    parser.add_argument('--baseline', default='2c16be9',
+                        help='git revision timed as the baseline, reading the csv and computing the metrics on start')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # (tree of run.py, working directory) of each path
+        paths = {}
+        if args.baseline:
+            baseline = os.path.join(tmp, 'baseline')
+            checkout(args.baseline, baseline)
+            shutil.copy(args.data, os.path.join(baseline, 'df_all.csv'))
+            paths[f'baseline ({args.baseline})'] = (baseline, baseline)
+
+        # this tree, attaching the same data published as a dataset version
+        current = os.path.join(tmp, 'current')
+        publish_dataset(pd.read_csv(args.data), os.path.join(current, DATASET_DIR))
+        paths['current'] = (REPO, current)
+
+        print(f"{'path':<24}{'median (s)':>12}{'wall (s)':>12}")
+        for name, (tree, cwd) in paths.items():
+            inner, wall = run(tree, cwd, args.repeat)
+            print(
+                f"{name:<24}{statistics.median(inner):>12.3f}{statistics.median(wall):>12.3f}")
@@ -2,6 +2,7 @@ import requests
 import pandas as pd
 import numpy as np
 import time
+from market_identity import normalize_blue_market_names
 
 
 def load_df_blue():
@@ -151,16 +152,9 @@ def load_df_blue():
     df_blue = pd.DataFrame(rows)
 
     # Dealing with different markets with the same name
-    df_blue.loc[df_blue['market_id'] == '0xc54d7acf14de29e0e5527cabd7a576506870346a78a11a6762e2cca66322ec41',
-                'market'] = 'WETH / wstETH (94.5) MP'
-    df_blue.loc[df_blue['market_id'] == '0xd0e50cdac92fe2172043f5e0c36532c6369d24947e40968f34a5e8819ca9ec5d',
-                'market'] = 'WETH / wstETH (94.5) ER'
+    df_blue = normalize_blue_market_names(df_blue)
 
-    df_blue['market'] = df_blue.apply(
-        lambda row: row['market'] + ' ' + row['market_id'][:5] if len(df_blue[df_blue['market'] == row['market']]['market_id'].unique()) > 1 else row['market'], axis=1
-    )
-
-    df_blue = df_blue.sort_values(by=['market', 'date'])
+    df_blue = df_blue.sort_values(by=['market_id', 'date'])
 
     # Remove rows with initial zeros for borrowApy until the first positive value within each market
     def remove_initial_zeros(group):
@@ -171,8 +165,8 @@ def load_df_blue():
 
    # Replace zero values with the previous valid value using forward fill within each market group
     df_blue['rate_at_target'] = df_blue.groupby(
-        'market')['rate_at_target'].transform(lambda x: x.replace(0, method='ffill'))
-    df_blue['borrowApy'] = df_blue.groupby('market')['borrowApy'].transform(
+        'market_id')['rate_at_target'].transform(lambda x: x.replace(0, method='ffill'))
+    df_blue['borrowApy'] = df_blue.groupby('market_id')['borrowApy'].transform(
         lambda x: x.replace(0, method='ffill'))
 
     print(df_blue.shape)
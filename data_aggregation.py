@@ -5,6 +5,8 @@ import time
 from blue_data import load_df_blue
 from aave_data import load_df_aave
 from compound_data import load_df_compound
+from market_identity import normalize_markets
+from shared_dataset import publish_dataset
 
 
 def load_df_all_protocols():
@@ -25,10 +27,12 @@ def load_df_all_protocols():
     df_aave = load_df_aave(relevant_markets)
     print("Aave data fetched!")
 
-    columns = ['date', 'protocol', 'market', 'loan_asset', 'supplyApy', 'borrowApy',
+    columns = ['date', 'protocol', 'market', 'market_id', 'loan_asset', 'supplyApy', 'borrowApy',
                'rate_at_target', 'utilization', 'totalSupplyUSD', 'totalBorrowUSD']
     df_aave['rate_at_target'] = np.nan
     df_compound['rate_at_target'] = np.nan
+    df_aave['market_id'] = np.nan
+    df_compound['market_id'] = np.nan
     df_aave['protocol'] = 'Aave'
     df_aave['market'] = df_aave['loan_asset'] + ' - Aave'
     df_compound['protocol'] = 'Compound'
@@ -46,42 +50,21 @@ def load_df_all_protocols():
     # df_all = df_all[(df_all['date'] >= df_all['min_date'])]
     # df_all = df_all.drop(columns=['min_date'])
 
-    # Add utilization_target information
-    utilization_targets = {
-        'Aave': {
-            'USDC': 0.92,
-            'USDT': 0.92,
-            'WETH': 0.90,
-            'DAI': 0.92,
-            'PYUSD': 0.80
-        },
-        'Compound': {
-            'WETH': 0.85,
-            'USDC': 0.90
-        },
-        'Blue': 0.90
-    }
-
-    def get_utilization_target(row):
-        if row['protocol'] == 'Blue':
-            return utilization_targets['Blue']
-        else:
-            return utilization_targets.get(row['protocol'], {}).get(row['loan_asset'], None)
-
-    df_all['utilization_target'] = df_all.apply(get_utilization_target, axis=1)
-
-    df_all = df_all.sort_values(by=['market', 'date'])
-    df_all['borrowApy_daily'] = df_all.groupby('market')['borrowApy'].transform(
+    # Add market keys and utilization_target, drop overlapping snapshots
+    df_all = normalize_markets(df_all)
+
+    df_all = df_all.sort_values(by=['market_key', 'date'])
+    df_all['borrowApy_daily'] = df_all.groupby('market_key')['borrowApy'].transform(
         lambda x: x.rolling(24, center=True).mean())
-    df_all['borrowApy_weekly'] = df_all.groupby('market')['borrowApy'].transform(
+    df_all['borrowApy_weekly'] = df_all.groupby('market_key')['borrowApy'].transform(
         lambda x: x.rolling(7*24, center=True).mean())
-    df_all['utilization_daily'] = df_all.groupby('market')['utilization'].transform(
+    df_all['utilization_daily'] = df_all.groupby('market_key')['utilization'].transform(
         lambda x: x.rolling(24, center=True).mean())
-    df_all['utilization_weekly'] = df_all.groupby('market')['utilization'].transform(
+    df_all['utilization_weekly'] = df_all.groupby('market_key')['utilization'].transform(
         lambda x: x.rolling(7*24, center=True).mean())
-    df_all['supplyApy_daily'] = df_all.groupby('market')['supplyApy'].transform(
+    df_all['supplyApy_daily'] = df_all.groupby('market_key')['supplyApy'].transform(
         lambda x: x.rolling(24, center=True).mean())
-    df_all['supplyApy_weekly'] = df_all.groupby('market')['supplyApy'].transform(
+    df_all['supplyApy_weekly'] = df_all.groupby('market_key')['supplyApy'].transform(
         lambda x: x.rolling(7*24, center=True).mean())
 
     # df_all = df_all.dropna(
@@ -104,6 +87,7 @@ if __name__ == '__main__':
         print("Data process completed!")
 
         df_all.to_csv('df_all.csv', index=False)
+        publish_dataset(df_all)
 
         with open("last_update.txt", 'w') as f:
             f.write(str(current_time))
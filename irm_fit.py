@@ -0,0 +1,268 @@
+import numpy as np
+import pandas as pd
+from metrics import compute_metrics
+from market_identity import market_key_column
+
+
+# Candidate kinks / targets scanned by the fits
+KINK_GRID = np.round(np.arange(0.50, 0.99, 0.01), 2)
+TARGET_GRID = np.round(np.arange(0.50, 0.99, 0.01), 2)
+
+
+def to_padded_arrays(df, columns, key=None):
+    """ stack each market's series into (n_markets, max_len) arrays, NaN padded """
+    key = key or market_key_column(df)
+    codes, markets = pd.factorize(df[key], sort=True)
+    order = np.lexsort((df['date'].values, codes))
+    codes = codes[order]
+    # position of each row within its market once sorted by date
+    starts = np.searchsorted(codes, np.arange(len(markets)))
+    position = np.arange(len(codes)) - starts[codes]
+    n_markets = len(markets)
+    n_steps = position.max() + 1 if len(position) else 0
+
+    arrays = {}
+    for column in columns:
+        values = np.full((n_markets, n_steps), np.nan)
+        values[codes, position] = df[column].values[order].astype(float)
+        arrays[column] = values
+    return np.asarray(markets), arrays
+
+
+class _SortedSums:
+    """ prefix sums of per-market series sorted by utilization
+
+    Once the kink (or target) is fixed both IRM models are linear in their
+    remaining parameters, and the normal equations only need sums over the
+    points on each side of the split. Sorting every market by utilization
+    once turns those sums into prefix-sum lookups, so scanning a candidate
+    costs O(n_markets) instead of a pass over every data point.
+    """
+
+    def __init__(self, U, mask, **series):
+        U = np.where(mask, U, np.inf)
+        order = np.argsort(U, axis=1, kind='stable')
+        self.U = np.take_along_axis(U, order, axis=1)
+        self.n = mask.sum(axis=1)
+        self.prefix = {}
+        for name, values in series.items():
+            values = np.where(mask, values, 0.0)
+            values = np.take_along_axis(values, order, axis=1)
+            cumsum = np.cumsum(values, axis=1)
+            self.prefix[name] = np.concatenate(
+                [np.zeros((len(cumsum), 1)), cumsum], axis=1)
+
+    def split_indices(self, thresholds):
+        """ number of points with u <= threshold, shape (n_markets, n_thresholds) """
+        return np.stack([np.searchsorted(row, thresholds, side='right') for row in self.U])
+
+    def split(self, idx):
+        """ (sums with u <= threshold, sums with u > threshold) given split_indices column """
+        idx = idx[:, None]
+        below, above = {}, {}
+        for name, prefix in self.prefix.items():
+            below[name] = np.take_along_axis(prefix, idx, axis=1)[:, 0]
+            above[name] = prefix[:, -1] - below[name]
+        below['n'] = idx[:, 0].astype(float)
+        above['n'] = self.n - below['n']
+        return below, above
+
+
+def kink_rate(U, base, slope1, slope2, kink):
+    return base + slope1 * np.minimum(U, kink) + slope2 * np.maximum(U - kink, 0)
+
+
+def fit_kink_models(U, r, kinks=KINK_GRID):
+    """ fit r(u) = base + slope1 * min(u, kink) + slope2 * max(u - kink, 0) for every market (row) """
+    mask = np.isfinite(U) & np.isfinite(r)
+    n_points = mask.sum(axis=1)
+    sums = _SortedSums(U, mask, u=U, uu=U**2, r=r, ur=U * r, rr=r**2)
+    total_rr = sums.prefix['rr'][:, -1]
+
+    best_sse = np.full(U.shape[0], np.inf)
+    best = np.full((U.shape[0], 4), np.nan)
+    split = sums.split_indices(kinks)
+    for i, c in enumerate(kinks):
+        b, a = sums.split(split[:, i])
+        # normal equations of the features [1, min(u, c), max(u - c, 0)]
+        XtX = np.empty((U.shape[0], 3, 3))
+        XtX[:, 0, 0] = b['n'] + a['n']
+        XtX[:, 0, 1] = XtX[:, 1, 0] = b['u'] + c * a['n']
+        XtX[:, 0, 2] = XtX[:, 2, 0] = a['u'] - c * a['n']
+        XtX[:, 1, 1] = b['uu'] + c**2 * a['n']
+        XtX[:, 1, 2] = XtX[:, 2, 1] = c * (a['u'] - c * a['n'])
+        XtX[:, 2, 2] = a['uu'] - 2 * c * a['u'] + c**2 * a['n']
+        Xty = np.stack([b['r'] + a['r'], b['ur'] + c * a['r'],
+                        a['ur'] - c * a['r']], axis=1)
+        # small ridge keeps markets that never cross the kink solvable
+        XtX += 1e-9 * np.eye(3)
+        coefs = np.linalg.solve(XtX, Xty[..., None])[..., 0]
+        sse = total_rr - 2 * np.sum(coefs * Xty, axis=1) + \
+            np.einsum('mk,mkl,ml->m', coefs, XtX, coefs)
+
+        better = sse < best_sse
+        best_sse[better] = sse[better]
+        best[better, :3] = coefs[better]
+        best[better, 3] = c
+
+    rmse = np.sqrt(np.maximum(best_sse, 0) / np.maximum(n_points, 1))
+    rmse[n_points < 3] = np.nan
+    best[n_points < 3] = np.nan
+    return pd.DataFrame({
+        'fit base': best[:, 0],
+        'fit slope1': best[:, 1],
+        'fit slope2': best[:, 2],
+        'fit kink': best[:, 3],
+        'fit rmse': rmse,
+        'fit points': n_points
+    })
+
+
+def adaptive_curve_error(U, target):
+    """ normalized distance to target used by Blue's adaptive curve IRM """
+    return np.where(U > target, (U - target) / (1 - target), (U - target) / target)
+
+
+def adaptive_curve_rate(U, rate_at_target, target, steepness):
+    err = adaptive_curve_error(U, target)
+    coef = np.where(err < 0, 1 - 1 / steepness, steepness - 1)
+    return rate_at_target * (1 + coef * err)
+
+
+def fit_adaptive_curves(U, r, rate_at_target, targets=TARGET_GRID):
+    """ fit target and curve slopes of the adaptive curve IRM, r = rate_at_target * curve(u) """
+    mask = np.isfinite(U) & np.isfinite(r) & np.isfinite(rate_at_target)
+    n_points = mask.sum(axis=1)
+    # r - rate_at_target = slope * rate_at_target * err on each side of the
+    # target, with err = (u - target) / scale: a 1D regression per side
+    y = r - rate_at_target
+    k = rate_at_target
+    sums = _SortedSums(U, mask, kk=k**2, kku=k**2 * U, kkuu=k**2 * U**2,
+                       ky=k * y, kuy=k * U * y, yy=y**2)
+    total_yy = sums.prefix['yy'][:, -1]
+
+    best_sse = np.full(U.shape[0], np.inf)
+    best = np.full((U.shape[0], 3), np.nan)
+    split = sums.split_indices(targets)
+    for i, t in enumerate(targets):
+        sse = total_yy.copy()
+        slopes = []
+        for side, scale in zip(sums.split(split[:, i]), (t, 1 - t)):
+            xx = (side['kkuu'] - 2 * t * side['kku'] + t**2 * side['kk']) / scale**2
+            xy = (side['kuy'] - t * side['ky']) / scale
+            slope = np.where(xx > 0, xy / np.where(xx > 0, xx, 1), 0.0)
+            sse -= slope * xy
+            slopes.append(slope)
+
+        better = sse < best_sse
+        best_sse[better] = sse[better]
+        best[better, 0] = slopes[0][better]
+        best[better, 1] = slopes[1][better]
+        best[better, 2] = t
+
+    rmse = np.sqrt(np.maximum(best_sse, 0) / np.maximum(n_points, 1))
+    rmse[n_points < 3] = np.nan
+    best[n_points < 3] = np.nan
+    return pd.DataFrame({
+        'fit target': best[:, 2],
+        'fit slope below': best[:, 0],
+        'fit slope above': best[:, 1],
+        # curve steepness as defined by the IRM: slope above target + 1
+        'fit steepness': best[:, 1] + 1,
+        'fit rmse': rmse,
+        'fit points': n_points
+    })
+
+
+def fit_irm_curves(df):
+    """ kink fits for Aave / Compound markets and adaptive curve fits for Blue markets
+
+    The dataset stores borrow APYs while the IRMs (and rate_at_target) are
+    continuously compounded APRs, so the fits run on log1p(borrowApy) and
+    their parameters and rmse are APRs.
+    """
+    key = market_key_column(df)
+    fits = []
+
+    df_kink = df[df['protocol'] != 'Blue']
+    if len(df_kink):
+        markets, arrays = to_padded_arrays(
+            df_kink, ['utilization', 'borrowApy'], key=key)
+        fit = fit_kink_models(
+            arrays['utilization'], np.log1p(arrays['borrowApy']))
+        fit.insert(0, key, markets)
+        fit.insert(1, 'irm model', 'kink')
+        fits.append(fit)
+
+    df_blue = df[df['protocol'] == 'Blue']
+    if len(df_blue):
+        markets, arrays = to_padded_arrays(
+            df_blue, ['utilization', 'borrowApy', 'rate_at_target'], key=key)
+        fit = fit_adaptive_curves(
+            arrays['utilization'], np.log1p(arrays['borrowApy']), arrays['rate_at_target'])
+        fit.insert(0, key, markets)
+        fit.insert(1, 'irm model', 'adaptive curve')
+        fits.append(fit)
+
+    if not fits:
+        return pd.DataFrame(columns=list(dict.fromkeys(['market', key, 'irm model'])))
+    fits = pd.concat(fits, ignore_index=True)
+    if key != 'market':
+        # display names, markets are identified by their key
+        names = df.drop_duplicates(key).set_index(key)['market']
+        fits.insert(0, 'market', fits[key].map(names).values)
+    return fits
+
+
+def fitted_curve(fit, rate_at_target=1.0, n_points=101):
+    """ borrow APY as a function of utilization for one row of fit_irm_curves """
+    U = np.linspace(0, 1, n_points)
+    if fit['irm model'] == 'kink':
+        r = kink_rate(U, fit['fit base'], fit['fit slope1'],
+                      fit['fit slope2'], fit['fit kink'])
+    else:
+        err = adaptive_curve_error(U, fit['fit target'])
+        r = rate_at_target * (1 + np.where(err < 0, fit['fit slope below'],
+                                           fit['fit slope above']) * err)
+    return U, np.expm1(r)
+
+
+def compute_metrics_with_fits(df):
+    """ compute_metrics table with the IRM fit of each market appended """
+    key = market_key_column(df)
+    fits = fit_irm_curves(df)
+    results = compute_metrics(df).merge(
+        fits.drop(columns='market') if key != 'market' else fits, on=key, how='left').sort_values('market')
+    return fits, results
+
+
+if __name__ == '__main__':
+    # Self-check: the fits recover the parameters of synthetic markets, whose
+    # borrow APYs are generated from known kink and adaptive curve IRMs
+    rng = np.random.default_rng(0)
+    n_points = 2000
+    U = np.clip(rng.normal(0.85, 0.08, n_points), 0, 1)
+    rate_at_target = np.exp(rng.normal(-3, 0.1, n_points))
+    df = pd.concat([
+        pd.DataFrame({'date': np.arange(n_points), 'market': 'kink', 'protocol': 'Aave',
+                      'utilization': U, 'rate_at_target': np.nan,
+                      'borrowApy': np.expm1(kink_rate(U, 0.01, 0.05, 0.8, 0.9))}),
+        pd.DataFrame({'date': np.arange(n_points), 'market': 'adaptive curve', 'protocol': 'Blue',
+                      'utilization': U, 'rate_at_target': rate_at_target,
+                      'borrowApy': np.expm1(adaptive_curve_rate(U, rate_at_target, 0.9, 4.0))})
+    ])
+    expected = {
+        'kink': {'fit base': 0.01, 'fit slope1': 0.05, 'fit slope2': 0.8, 'fit kink': 0.9},
+        'adaptive curve': {'fit target': 0.9, 'fit slope below': 0.75, 'fit steepness': 4.0}
+    }
+    fits = fit_irm_curves(df).set_index('market')
+    failed = False
+    for market, params in expected.items():
+        fitted = fits.loc[market, list(params)].astype(float)
+        ok = np.allclose(fitted, list(params.values()), atol=1e-6)
+        print(f"{market} fit: {'ok' if ok else 'MISMATCH'}")
+        if not ok:
+            print(pd.DataFrame({'fitted': fitted, 'expected': params}))
+            failed = True
+    if failed:
+        raise SystemExit(1)
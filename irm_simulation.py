@@ -0,0 +1,311 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from irm_fit import to_padded_arrays, kink_rate, adaptive_curve_error, adaptive_curve_rate
+from market_identity import market_key_column
+from metrics import IAE, ISE, inside_spread, volatility, average_rate, average_utilization
+
+
+SECONDS_PER_YEAR = 365 * 24 * 3600
+
+# Defaults of Blue's adaptive curve IRM, rates are APRs
+ADAPTIVE_DEFAULTS = {
+    'target': 0.90,
+    'steepness': 4.0,
+    'adjustment_speed': 50.0,
+    'initial_rate_at_target': 0.04,
+    'min_rate_at_target': 0.001,
+    'max_rate_at_target': 2.0,
+    'utilization_elasticity': 0.0
+}
+KINK_DEFAULTS = {
+    'base': 0.0,
+    'slope1': 0.04,
+    'slope2': 0.60,
+    'kink': 0.90,
+    'utilization_elasticity': 0.0
+}
+
+# Memory budget of one simulation chunk, paid by every worker process. A
+# chunk keeps about CHUNK_LIVE_ARRAYS float64 arrays of markets x scenarios x
+# time steps alive at its peak (simulated utilization, rate and borrow APY and
+# the temporaries of the metrics), measured at 64 bytes per cell
+MAX_CHUNK_BYTES = 256 * 2**20
+CHUNK_LIVE_ARRAYS = 8
+
+METRICS = ['avg utilization', 'avg borrow rate', 'IAE', 'ISE',
+           'inside_spread', 'utilization volatility', 'rate volatility']
+
+
+def parameter_grid(**values):
+    """ cartesian product of parameter values, e.g. parameter_grid(target=[0.8, 0.9], steepness=[4]) """
+    names = list(values)
+    return pd.DataFrame(list(itertools.product(*values.values())), columns=names)
+
+
+def simulate_rates(U_obs, r_obs, dt, params, model='adaptive'):
+    """ replay utilization through `model`, returns simulated (utilization, APR)
+
+    U_obs, r_obs (observed APR), dt (years since the previous point): (markets, 1, T),
+    params: dict of (1, scenarios, 1) arrays. Borrowers respond to the simulated
+    rate: utilization moves by -utilization_elasticity * (simulated - observed APR)
+    of the previous step, an elasticity of 0 replays the observed utilization.
+    The adaptive rate at target drifts by exp(speed * err * dt) over each interval
+    using the error at its start, and is kept within its bounds after every step.
+    """
+    p = {name: values[..., 0] for name, values in params.items()}
+    shape = np.broadcast_shapes(U_obs.shape[:-1], p['utilization_elasticity'].shape) + \
+        U_obs.shape[-1:]
+    U = np.empty(shape)
+    rate = np.empty(shape)
+
+    if model == 'adaptive':
+        log_rate_at_target = np.log(p['initial_rate_at_target'])
+        log_min = np.log(p['min_rate_at_target'])
+        log_max = np.log(p['max_rate_at_target'])
+
+    # sequential in time only, every market x scenario advances together
+    feedback = 0.0
+    for i in range(shape[-1]):
+        u_obs = U_obs[..., i]
+        u = u_obs - p['utilization_elasticity'] * feedback
+        u = np.clip(u, 0, np.maximum(u_obs, 1))
+        if model == 'adaptive':
+            r = adaptive_curve_rate(u, np.exp(log_rate_at_target),
+                                    p['target'], p['steepness'])
+            if i + 1 < shape[-1]:
+                err = adaptive_curve_error(u, p['target'])
+                log_rate_at_target = np.clip(
+                    log_rate_at_target + p['adjustment_speed'] * np.nan_to_num(err) * dt[..., i + 1], log_min, log_max)
+        else:
+            r = kink_rate(u, p['base'], p['slope1'], p['slope2'], p['kink'])
+        U[..., i] = u
+        rate[..., i] = r
+        feedback = np.nan_to_num(r - r_obs[..., i])
+    return U, rate
+
+
+# Batched versions of the metrics.py functions: rows are scenarios, rows of
+# the market (`exists`) are kept apart from padding and NaN behaves as in
+# metrics.py. _check_against_metrics compares both on one market.
+
+
+def _batch_mean(x, exists):
+    return np.sum(np.where(exists, x, 0), axis=-1) / exists.sum(axis=-1)
+
+
+def _batch_nanmean(x, exists):
+    """ metrics.average_rate averages a Series, which skips NaN """
+    valid = exists & ~np.isnan(x)
+    return np.sum(np.where(valid, x, 0), axis=-1) / valid.sum(axis=-1)
+
+
+def _batch_IAE(U, u_target, exists):
+    return _batch_mean(np.abs(U - u_target), exists)
+
+
+def _batch_ISE(U, u_target, exists):
+    return _batch_mean((U - u_target)**2, exists)
+
+
+def _batch_inside_spread(r, U, r_B, r_D, exists):
+    inside = exists & (r < r_B) & (r*U > r_D)
+    return np.count_nonzero(inside, axis=-1) / exists.sum(axis=-1)
+
+
+def _batch_volatility(x, exists):
+    """ metrics.volatility: std of pct_change, which forward-fills gaps first """
+    position = np.arange(x.shape[-1])
+    last_valid = np.maximum.accumulate(
+        np.where(np.isnan(x), 0, position), axis=-1)
+    x = np.take_along_axis(x, np.broadcast_to(last_valid, x.shape), axis=-1)
+    change = x[..., 1:] / x[..., :-1] - 1
+    valid = exists[..., 1:] & ~np.isnan(change)
+    n = valid.sum(axis=-1)
+    mean = np.sum(np.where(valid, change, 0), axis=-1) / np.maximum(n, 1)
+    var = np.sum(np.where(valid, (change - mean[..., None])**2, 0), axis=-1) / \
+        np.maximum(n - 1, 1)
+    return np.where(n > 1, np.sqrt(var), np.nan)*((252*24)**0.5)
+
+
+def _simulate_chunk(arrays, model, grid):
+    U_obs = arrays['utilization'][:, None, :]
+    r_B = arrays['borrowApy'][:, None, :]
+    r_D = arrays['supplyApy'][:, None, :]
+    exists = np.isfinite(arrays['t'])[:, None, :]
+    params = {name: grid[name].values[None, :, None] for name in grid}
+
+    seconds = arrays['t'][:, None, :]
+    dt = np.nan_to_num(np.diff(seconds, axis=-1, prepend=seconds[..., :1])) / \
+        SECONDS_PER_YEAR
+    U, rate = simulate_rates(U_obs, np.log1p(r_B), dt, params, model)
+    u_target = params['target'] if model == 'adaptive' else params['kink']
+
+    # the dataset stores APYs, the IRMs return APRs
+    borrow_apy = np.expm1(rate)
+    exists = np.broadcast_to(exists, U.shape)
+    return {
+        'avg utilization': _batch_mean(U, exists),
+        'avg borrow rate': _batch_nanmean(borrow_apy, exists),
+        'IAE': _batch_IAE(U, u_target, exists),
+        'ISE': _batch_ISE(U, u_target, exists),
+        'inside_spread': _batch_inside_spread(borrow_apy, U, r_B, r_D, exists),
+        'utilization volatility': _batch_volatility(U, exists),
+        'rate volatility': _batch_volatility(borrow_apy, exists)
+    }
+
+
+def _padded_market_arrays(df):
+    df = df.copy()
+    df['t'] = pd.to_datetime(df['date']).values.astype(
+        'datetime64[s]').astype(float)
+    return to_padded_arrays(df, ['t', 'utilization', 'borrowApy', 'supplyApy'])
+
+
+def _simulate_markets(df, model, grid):
+    markets, arrays = _padded_market_arrays(df)
+    n_markets, n_steps = arrays['t'].shape
+    n_scenarios = len(grid)
+
+    # chunk scenarios and markets so that a chunk stays within MAX_CHUNK_BYTES
+    max_cells = MAX_CHUNK_BYTES // (CHUNK_LIVE_ARRAYS * np.dtype(float).itemsize)
+    scenario_chunk = max(1, min(n_scenarios, max_cells // max(n_steps, 1)))
+    market_chunk = max(1, max_cells // max(scenario_chunk * n_steps, 1))
+
+    metrics = {name: np.empty((n_markets, n_scenarios)) for name in METRICS}
+    for m in range(0, n_markets, market_chunk):
+        chunk_arrays = {name: values[m:m + market_chunk]
+                        for name, values in arrays.items()}
+        for g in range(0, n_scenarios, scenario_chunk):
+            chunk_metrics = _simulate_chunk(
+                chunk_arrays, model, grid.iloc[g:g + scenario_chunk])
+            for name, values in chunk_metrics.items():
+                metrics[name][m:m + market_chunk, g:g + scenario_chunk] = values
+
+    key = market_key_column(df)
+    result = pd.DataFrame({key: np.repeat(markets, n_scenarios)})
+    if key != 'market':
+        names = df.drop_duplicates(key).set_index(key)['market']
+        result.insert(0, 'market', result[key].map(names).values)
+    for name in grid:
+        result[name] = np.tile(grid[name].values, n_markets)
+    for name, values in metrics.items():
+        result[name] = values.ravel()
+    return result
+
+
+def _complete_grid(grid, model):
+    defaults = ADAPTIVE_DEFAULTS if model == 'adaptive' else KINK_DEFAULTS
+    unknown = set(grid.columns) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown {model} parameters: {sorted(unknown)}")
+    grid = grid.reset_index(drop=True).copy()
+    for name, value in defaults.items():
+        if name not in grid:
+            grid[name] = value
+    return grid
+
+
+def simulate(df, grid, model='adaptive', markets=None, n_workers=None):
+    """ replay every market's utilization through `model` for each row of `grid`
+
+    Parameters missing from `grid` take their default value. Returns one row
+    per (market, scenario) with the metrics.py metrics of the simulated
+    utilization and borrow APY: IAE / ISE against the scenario target (they
+    only depend on the rate model through utilization_elasticity), the
+    inside_spread of the simulated rate w.r.t. the market's observed rates and
+    volatilities. markets restricts the simulation to these market keys, since
+    display names are not unique across deployments. With n_workers, markets
+    are split across a process pool and each worker uses up to MAX_CHUNK_BYTES.
+    """
+    grid = _complete_grid(grid, model)
+
+    key = market_key_column(df)
+    if markets is not None:
+        df = df[df[key].isin(markets)]
+    market_keys = df[key].unique()
+
+    if not n_workers or n_workers <= 1 or len(market_keys) <= 1:
+        return _simulate_markets(df, model, grid)
+
+    groups = np.array_split(market_keys, min(n_workers, len(market_keys)))
+    with ProcessPoolExecutor(max_workers=len(groups)) as executor:
+        futures = [executor.submit(_simulate_markets, df[df[key].isin(group)], model, grid)
+                   for group in groups]
+        results = [future.result() for future in futures]
+    return pd.concat(results, ignore_index=True).sort_values(
+        by=key, kind='stable').reset_index(drop=True)
+
+
+def _check_against_metrics(df, market, params=None, model='adaptive'):
+    """ simulate one scenario of one market and evaluate it with metrics.py
+
+    Returns a DataFrame of each batch metric next to its metrics.py value;
+    the two columns should be equal.
+    """
+    grid = _complete_grid(pd.DataFrame([params or {}]), model)
+    df_market = df[df[market_key_column(df)] == market]
+    batch = _simulate_markets(df_market, model, grid).iloc[0]
+
+    _, arrays = _padded_market_arrays(df_market)
+    params = {name: grid[name].values[None, :, None] for name in grid}
+    seconds = arrays['t'][:, None, :]
+    dt = np.nan_to_num(np.diff(seconds, axis=-1, prepend=seconds[..., :1])) / \
+        SECONDS_PER_YEAR
+    U, rate = simulate_rates(arrays['utilization'][:, None, :],
+                             np.log1p(arrays['borrowApy'][:, None, :]), dt, params, model)
+    simulated = pd.DataFrame({'utilization': U[0, 0], 'borrowApy': np.expm1(rate[0, 0])})
+    u_target = grid['target' if model == 'adaptive' else 'kink'].iloc[0]
+
+    U, r = simulated['utilization'].values, simulated['borrowApy'].values
+    reference = {
+        'avg utilization': average_utilization(U),
+        'avg borrow rate': average_rate(simulated),
+        'IAE': IAE(U, u_target),
+        'ISE': ISE(U, u_target),
+        'inside_spread': inside_spread(r, U, arrays['borrowApy'][0], arrays['supplyApy'][0]),
+        'utilization volatility': volatility(simulated, 'utilization'),
+        'rate volatility': volatility(simulated, 'borrowApy')
+    }
+    return pd.DataFrame({'simulate': batch[METRICS].astype(float),
+                         'metrics.py': pd.Series(reference)})
+
+
+if __name__ == '__main__':
+    # Self-check: batched metrics against metrics.py on one market per IRM
+    # model, and chunked against unchunked simulations
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Check the simulator against metrics.py on a dataset')
+    parser.add_argument('--data', default='df_all.csv')
+    args = parser.parse_args()
+
+    df_all = pd.read_csv(args.data)
+    key = market_key_column(df_all)
+    failed = False
+    for model, rows in [('adaptive', df_all['protocol'] == 'Blue'),
+                        ('kink', df_all['protocol'] != 'Blue')]:
+        if not rows.any():
+            continue
+        market = df_all.loc[rows, key].iloc[0]
+        for elasticity in [0.0, 0.5]:
+            check = _check_against_metrics(
+                df_all, market, {'utilization_elasticity': elasticity}, model)
+            ok = np.allclose(check['simulate'], check['metrics.py'], equal_nan=True)
+            print(f"{model} {market} elasticity {elasticity}: {'ok' if ok else 'MISMATCH'}")
+            if not ok:
+                print(check)
+                failed = True
+
+    grid = parameter_grid(target=[0.8, 0.9], utilization_elasticity=[0.0, 0.5])
+    markets = list(df_all[key].unique()[:4])
+    expected = simulate(df_all, grid, markets=markets)
+    # a few hundred cells per chunk
+    MAX_CHUNK_BYTES = 500 * CHUNK_LIVE_ARRAYS * 8
+    ok = simulate(df_all, grid, markets=markets).equals(expected)
+    print(f"chunked simulation: {'ok' if ok else 'MISMATCH'}")
+    if failed or not ok:
+        raise SystemExit(1)
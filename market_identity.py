@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+
+# Display names for Blue markets that would otherwise share the same name
+MARKET_NAME_OVERRIDES = pd.DataFrame([
+    ('0xc54d7acf14de29e0e5527cabd7a576506870346a78a11a6762e2cca66322ec41',
+     'WETH / wstETH (94.5) MP'),
+    ('0xd0e50cdac92fe2172043f5e0c36532c6369d24947e40968f34a5e8819ca9ec5d',
+     'WETH / wstETH (94.5) ER'),
+], columns=['market_id', 'market'])
+
+# Length of the market_id suffix telling apart Blue markets with the same name
+MARKET_ID_SUFFIX_LENGTH = 10
+
+# Utilization targets, a missing loan_asset applies to every market of the protocol
+UTILIZATION_TARGETS = pd.DataFrame([
+    ('Aave', 'USDC', 0.92),
+    ('Aave', 'USDT', 0.92),
+    ('Aave', 'WETH', 0.90),
+    ('Aave', 'DAI', 0.92),
+    ('Aave', 'PYUSD', 0.80),
+    ('Compound', 'WETH', 0.85),
+    ('Compound', 'USDC', 0.90),
+    ('Blue', None, 0.90),
+], columns=['protocol', 'loan_asset', 'utilization_target'])
+
+
+def normalize_blue_market_names(df_blue, overrides=MARKET_NAME_OVERRIDES):
+    """ make Blue display names unique per market_id """
+    override = df_blue['market_id'].map(
+        overrides.set_index('market_id')['market'])
+    df_blue['market'] = override.fillna(df_blue['market'])
+
+    # names still shared by several markets get a market_id prefix
+    n_ids = df_blue.groupby('market')['market_id'].transform('nunique')
+    shared = n_ids > 1
+    df_blue.loc[shared, 'market'] = df_blue.loc[shared, 'market'] + \
+        ' ' + df_blue.loc[shared, 'market_id'].str[:MARKET_ID_SUFFIX_LENGTH]
+    return df_blue
+
+
+def market_key_column(df):
+    """ column identifying markets: market_key, or the display name for data published without it """
+    return 'market_key' if 'market_key' in df.columns else 'market'
+
+
+def add_market_keys(df_all):
+    """ stable market key: the market_id for Blue, the loan asset for Aave / Compound """
+    identifier = df_all['loan_asset'].where(
+        df_all['protocol'] != 'Blue', df_all['market_id'])
+    df_all['market_key'] = df_all['protocol'] + ':' + identifier
+    return df_all
+
+
+def deduplicate_snapshots(df_all, key='market_key'):
+    """ keep the last snapshot of each (market, date) """
+    return df_all.drop_duplicates(subset=[key, 'date'], keep='last')
+
+
+def attach_utilization_targets(df_all, targets=UTILIZATION_TARGETS):
+    specific = targets.dropna(subset=['loan_asset'])
+    default = targets[targets['loan_asset'].isna()]
+
+    keys = pd.MultiIndex.from_frame(df_all[['protocol', 'loan_asset']])
+    target = specific.set_index(['protocol', 'loan_asset'])[
+        'utilization_target'].reindex(keys).values
+    fallback = df_all['protocol'].map(
+        default.set_index('protocol')['utilization_target']).values
+    df_all['utilization_target'] = np.where(
+        pd.isna(target), fallback, target).astype(float)
+    return df_all
+
+
+def normalize_markets(df_all):
+    """ key, attach targets to and deduplicate the concatenated protocol data """
+    df_all = add_market_keys(df_all)
+    df_all = attach_utilization_targets(df_all)
+    return deduplicate_snapshots(df_all)
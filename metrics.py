@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+from market_identity import market_key_column
 
 
 def IAE(U, u_target):
@@ -66,12 +67,11 @@ def compute_metrics(df):
     metrics_columns = ['avg utilization', 'avg borrow rate', 'IAE', 'ISE', 'Liquidity',
                        'ISE_positive', 'IAE_negative', 'utilization volatility', 'rate volatility']
 
+    key = market_key_column(df)
     results_df = pd.DataFrame(
-        columns=['market', 'loan_asset', 'utilization_target'] + metrics_columns)
-    markets = df['market'].unique()
+        columns=list(dict.fromkeys(['market', key, 'loan_asset', 'utilization_target'])) + metrics_columns)
 
-    for market in markets:
-        market_data = df[df['market'] == market]
+    for market, market_data in df.groupby(key, sort=False, observed=True):
         U = market_data['utilization'].values
         u_target = market_data['utilization_target'].values[0]
 
@@ -79,6 +79,7 @@ def compute_metrics(df):
             metrics = {
                 'utilization_target': u_target,
                 'market': market_data['market'].iloc[0],
+                key: market,
                 'loan_asset': market_data['loan_asset'].iloc[0],
                 'IAE': round(IAE(U, u_target), 3),
                 'ISE': round(ISE(U, u_target), 3),
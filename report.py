@@ -0,0 +1,120 @@
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from irm_fit import compute_metrics_with_fits
+from views import update_graphs, update_table, update_fit_graph, update_heatmap
+from shared_dataset import DATASET_DIR, attach_dataset, current_version, publish_dataset
+
+
+ROLLING_WINDOWS = ['hourly rolling avg',
+                   'daily rolling avg', 'weekly rolling avg']
+
+# Dataset of the worker process, attached once per worker by _init_worker
+_df_all = None
+
+
+def _init_worker(root, version):
+    global _df_all
+    _df_all = attach_dataset(root, version)
+
+
+def _file_name(name):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_')
+
+
+def _write_figure(fig, path, image_format):
+    if image_format == 'html':
+        fig.write_html(f'{path}.html', include_plotlyjs='cdn')
+    else:
+        # static images need the kaleido package
+        fig.write_image(f'{path}.{image_format}')
+
+
+def _build_asset_report(loan_asset, output_dir, **kwargs):
+    return build_asset_report(_df_all, loan_asset, output_dir, **kwargs)
+
+
+def build_asset_report(df_all, loan_asset, output_dir, rolling_windows=ROLLING_WINDOWS,
+                       min_totalSupplyUSD=0, image_format='html'):
+    """ metrics table, fitted curves, graphs and heatmaps of one loan asset """
+    start = time.time()
+    df_asset = df_all[df_all['loan_asset'] == loan_asset]
+    # same default market selection as the dashboard
+    markets = list(df_asset[df_asset['totalSupplyUSD'] >
+                            min_totalSupplyUSD]['market'].unique())
+
+    fits, results = compute_metrics_with_fits(df_asset)
+    results = results[results['market'].isin(markets)]
+
+    asset_dir = os.path.join(output_dir, _file_name(loan_asset))
+    os.makedirs(asset_dir, exist_ok=True)
+
+    table = pd.DataFrame(update_table(results, loan_asset, markets))
+    table.to_csv(os.path.join(asset_dir, 'metrics.csv'), index=False)
+    _write_figure(update_fit_graph(df_asset, fits, loan_asset, markets),
+                  os.path.join(asset_dir, 'fitted_curves'), image_format)
+
+    for rolling_window in rolling_windows:
+        suffix = _file_name(rolling_window)
+        figs = update_graphs(df_asset, loan_asset, markets, rolling_window)
+        for name, fig in zip(['borrow_rate', 'supply_rate', 'utilization', 'rate_at_target'], figs):
+            _write_figure(fig, os.path.join(
+                asset_dir, f'{name}_{suffix}'), image_format)
+        _write_figure(update_heatmap(df_asset, loan_asset, rolling_window, markets),
+                      os.path.join(asset_dir, f'heatmap_{suffix}'), image_format)
+
+    return loan_asset, results, time.time() - start
+
+
+def build_report(output_dir, root=DATASET_DIR, version=None, workers=None, **kwargs):
+    """ build_asset_report for every loan asset, in parallel over a process pool """
+    version = version or current_version(root)
+    loan_assets = attach_dataset(root, version)['loan_asset'].dropna().unique()
+    workers = workers or os.cpu_count()
+
+    # every worker maps the same published dataset version, nothing is copied to them
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(root, version)) as executor:
+        futures = [executor.submit(_build_asset_report, loan_asset, output_dir, **kwargs)
+                   for loan_asset in loan_assets]
+        reports = []
+        for future in futures:
+            loan_asset, results, elapsed = future.result()
+            print(f"{loan_asset}: {len(results)} markets in {elapsed:.1f}s")
+            reports.append(results)
+
+    results = pd.concat(reports, ignore_index=True)
+    results.to_csv(os.path.join(output_dir, 'metrics.csv'), index=False)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate the metrics tables, heatmaps and figures of every loan asset')
+    parser.add_argument('--dataset', default=DATASET_DIR,
+                        help='published dataset directory')
+    parser.add_argument('--data', default='df_all.csv',
+                        help='csv published to --dataset when it is empty')
+    parser.add_argument('--output', default=os.path.join(
+        'reports', time.strftime('%Y-%m-%d')))
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes, defaults to the number of cores')
+    parser.add_argument('--rolling-window', choices=ROLLING_WINDOWS, action='append',
+                        help='can be repeated, defaults to every rolling window')
+    parser.add_argument('--min-total-supply-usd', type=float, default=0)
+    parser.add_argument('--format', choices=['html', 'png', 'svg', 'pdf'], default='html',
+                        help='figure format, static formats need kaleido')
+    args = parser.parse_args()
+
+    start = time.time()
+    if current_version(args.dataset) is None:
+        publish_dataset(pd.read_csv(args.data), args.dataset)
+    os.makedirs(args.output, exist_ok=True)
+    build_report(args.output, root=args.dataset, workers=args.workers,
+                 rolling_windows=args.rolling_window or ROLLING_WINDOWS,
+                 min_totalSupplyUSD=args.min_total_supply_usd,
+                 image_format=args.format)
+    print(f"Report written to {args.output} in {time.time() - start:.1f}s")
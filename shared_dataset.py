@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+
+DATASET_DIR = 'dataset'
+CURRENT = 'CURRENT'
+# versions kept on disk, older ones are removed when a new one is published
+KEEP_VERSIONS = 2
+
+
+def _codes_dtype(n_categories):
+    """ smallest code dtype, the one pandas would pick for a Categorical of n_categories """
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def publish_dataset(df, root=DATASET_DIR, datetime_columns=('date',), keep=KEEP_VERSIONS):
+    """ write df as a new columnar version under root and make it the current one
+
+    Numeric columns are stored together as one float64 (columns, rows) array so
+    that attach_dataset can map them into a single DataFrame block without
+    copying. String columns are stored as the codes and categories of a
+    Categorical, with the code dtype pandas uses so they attach as is.
+    The switch to the new version is an atomic rename of the CURRENT file, and
+    sessions attached to an older version keep their mapping until they reload.
+    """
+    version = f"{time.time():.6f}"
+    path = os.path.join(root, version)
+    os.makedirs(path)
+
+    manifest = {'version': version, 'n_rows': len(df), 'columns': list(df.columns),
+                'numeric': [], 'datetime': [], 'strings': {}}
+    for column in df.columns:
+        values = df[column]
+        if column in datetime_columns or pd.api.types.is_datetime64_any_dtype(values):
+            np.save(os.path.join(path, f'{column}.npy'),
+                    pd.to_datetime(values).values.astype('datetime64[ns]'))
+            manifest['datetime'].append(column)
+        elif pd.api.types.is_numeric_dtype(values):
+            manifest['numeric'].append(column)
+        else:
+            codes, categories = pd.factorize(values)
+            np.save(os.path.join(path, f'{column}.codes.npy'),
+                    codes.astype(_codes_dtype(len(categories))))
+            manifest['strings'][column] = [str(c) for c in categories]
+
+    numeric = np.ascontiguousarray(
+        df[manifest['numeric']].values.astype(np.float64).T)
+    np.save(os.path.join(path, 'numeric.npy'), numeric)
+
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    tmp = os.path.join(root, f'{CURRENT}.{version}.tmp')
+    with open(tmp, 'w') as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(root, CURRENT))
+
+    # mapped files stay readable after being unlinked, so older versions can go
+    versions = sorted((v for v in os.listdir(root)
+                       if os.path.isdir(os.path.join(root, v))), key=float)
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return version
+
+
+def current_version(root=DATASET_DIR):
+    try:
+        with open(os.path.join(root, CURRENT), 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def attach_dataset(root=DATASET_DIR, version=None):
+    """ read-only DataFrame backed by the memory-mapped files of a published version
+
+    Every column is a view of the mapped files, shared with every other
+    process attached to the same version: the numeric block, the datetime
+    columns and the codes of the string columns, which attach as Categoricals.
+    Columns are grouped by type rather than in their published order,
+    reordering would copy the numeric block.
+    """
+    version = version or current_version(root)
+    if version is None:
+        raise FileNotFoundError(f"No dataset published in {root}")
+    path = os.path.join(root, version)
+    with open(os.path.join(path, 'manifest.json'), 'r') as f:
+        manifest = json.load(f)
+
+    numeric = np.load(os.path.join(path, 'numeric.npy'), mmap_mode='r')
+    frames = [pd.DataFrame(numeric.T, columns=manifest['numeric'], copy=False)]
+
+    # assigning columns would copy them, concatenating blocks does not
+    columns = {}
+    for column in manifest['datetime']:
+        columns[column] = pd.Series(np.load(os.path.join(
+            path, f'{column}.npy'), mmap_mode='r'), copy=False)
+    for column, categories in manifest['strings'].items():
+        codes = np.load(os.path.join(
+            path, f'{column}.codes.npy'), mmap_mode='r')
+        columns[column] = pd.Series(
+            pd.Categorical.from_codes(codes, categories), copy=False)
+    if columns:
+        frames.append(pd.DataFrame(columns, copy=False))
+
+    df = pd.concat(frames, axis=1, copy=False)
+    df.attrs['version'] = version
+    return df
@@ -0,0 +1,191 @@
+import numpy as np
+import pandas as pd
+from irm_fit import fitted_curve
+
+# plotly and scipy are imported inside the functions that need them, so the
+# dashboard only pays for them once a view using them is rendered
+
+dict_borrow_rate_type = {
+    'hourly rolling avg': 'borrowApy',
+    'daily rolling avg': 'borrowApy_daily',
+    'weekly rolling avg': 'borrowApy_weekly'
+}
+dic_utilization_type = {
+    'hourly rolling avg': 'utilization',
+    'daily rolling avg': 'utilization_daily',
+    'weekly rolling avg': 'utilization_weekly'
+}
+dict_supply_rate_type = {
+    'hourly rolling avg': 'supplyApy',
+    'daily rolling avg': 'supplyApy_daily',
+    'weekly rolling avg': 'supplyApy_weekly'
+}
+
+# Function to update graphs
+
+
+def update_graphs(df_all, selected_loan_asset, selected_markets, rolling_window):
+    import plotly.graph_objects as go
+    from plotly.colors import qualitative
+
+    traces_utilization = []
+    traces_supply_rate = []
+    traces_borrow_rate = []
+    traces_rate_at_target = []
+
+    if selected_loan_asset:
+        filtered_df = df_all[df_all['loan_asset'] == selected_loan_asset]
+
+        if selected_markets:
+            filtered_df = filtered_df[filtered_df['market'].isin(
+                selected_markets)]
+
+        unique_markets = filtered_df['market'].unique()
+
+        color_map = {market: qualitative.Plotly[i % len(qualitative.Plotly)]
+                     for i, market in enumerate(unique_markets)}
+
+        for market in unique_markets:
+            market_data = filtered_df[filtered_df['market'] == market]
+            color = color_map[market]
+            if rolling_window:
+                traces_supply_rate.append(go.Scatter(
+                    x=market_data['date'], y=market_data[dict_supply_rate_type[rolling_window]], mode='lines', name=f'{market}', line=dict(color=color)))
+                traces_borrow_rate.append(go.Scatter(
+                    x=market_data['date'], y=market_data[dict_borrow_rate_type[rolling_window]], mode='lines', name=f'{market}', line=dict(color=color)))
+                traces_utilization.append(go.Scatter(
+                    x=market_data['date'], y=market_data[dic_utilization_type[rolling_window]], mode='lines', name=f'{market}', line=dict(color=color)))
+
+            if market_data['protocol'].iloc[0] == 'Blue':
+                traces_rate_at_target.append(go.Scatter(
+                    x=market_data['date'], y=market_data['rate_at_target'], mode='lines', name=f'{market}', line=dict(color=color)))
+
+    utilization_fig = go.Figure(data=traces_utilization)
+    utilization_fig.update_layout(
+        title=f'Evolution of Utilization for {selected_loan_asset}' if selected_loan_asset else 'Evolution of Utilization')
+
+    borrow_rate_fig = go.Figure(data=traces_borrow_rate)
+    borrow_rate_fig.update_layout(
+        title=f'Evolution of Borrow Rate for {selected_loan_asset}' if selected_loan_asset else 'Evolution of Borrow Rate')
+
+    supply_rate_fig = go.Figure(data=traces_supply_rate)
+    supply_rate_fig.update_layout(
+        title=f'Evolution of Supply Rate for {selected_loan_asset}' if selected_loan_asset else 'Evolution of Supply Rate')
+
+    rate_at_target_fig = go.Figure(data=traces_rate_at_target)
+    rate_at_target_fig.update_layout(
+        title=f'Evolution of Rate at Target for {selected_loan_asset}' if selected_loan_asset else 'Evolution of Rate at Target')
+
+    return borrow_rate_fig, supply_rate_fig, utilization_fig, rate_at_target_fig
+
+# Function to update table
+
+
+def update_table(results, selected_loan_asset, selected_markets):
+    if selected_loan_asset:
+        filtered_df = results[results['loan_asset'] == selected_loan_asset]
+        if selected_markets:
+            filtered_df = filtered_df[filtered_df['market'].isin(
+                selected_markets)]
+    else:
+        filtered_df = results
+    return filtered_df.drop('loan_asset', axis=1).to_dict('records')
+
+# Function to update fitted IRM curves
+
+
+def update_fit_graph(df_all, fits, selected_loan_asset, selected_markets):
+    import plotly.graph_objects as go
+    from plotly.colors import qualitative
+
+    filtered_df = df_all[(df_all['loan_asset'] == selected_loan_asset) & (
+        df_all['market'].isin(selected_markets))]
+    filtered_fits = fits[fits['market'].isin(selected_markets)]
+
+    traces = []
+    for i, fit in enumerate(filtered_fits.to_dict('records')):
+        color = qualitative.Plotly[i % len(qualitative.Plotly)]
+        market_data = filtered_df[filtered_df['market'] == fit['market']]
+        # adaptive curves are drawn at the latest rate at target
+        rate_at_target = market_data['rate_at_target'].dropna()
+        rate_at_target = rate_at_target.iloc[-1] if len(
+            rate_at_target) else 1.0
+        U, r = fitted_curve(fit, rate_at_target)
+        traces.append(go.Scatter(
+            x=market_data['utilization'], y=market_data['borrowApy'], mode='markers', name=f"{fit['market']}",
+            marker=dict(color=color, size=3, opacity=0.3), showlegend=False))
+        traces.append(go.Scatter(
+            x=U, y=r, mode='lines', name=f"{fit['market']} (rmse {fit['fit rmse']:.4f})", line=dict(color=color)))
+
+    fig = go.Figure(data=traces)
+    fig.update_layout(
+        title=f'Fitted IRM curves for {selected_loan_asset}', xaxis_title='utilization', yaxis_title='borrowApy')
+    return fig
+
+# Function to update heatmap
+
+
+def pairwise_corr_with_pvalues(df):
+    from scipy.stats import pearsonr
+
+    corr_matrix = pd.DataFrame(index=df.columns, columns=df.columns)
+    pvalue_matrix = pd.DataFrame(index=df.columns, columns=df.columns)
+
+    for col1 in df.columns:
+        for col2 in df.columns:
+            valid_idx = df[[col1, col2]].dropna().index
+            if len(valid_idx) > 1:  # Ensure there are at least 2 valid points
+                corr, pvalue = pearsonr(
+                    df.loc[valid_idx, col1], df.loc[valid_idx, col2])
+                corr_matrix.at[col1, col2] = corr
+                pvalue_matrix.at[col1, col2] = pvalue
+            else:
+                corr_matrix.at[col1, col2] = np.nan
+                pvalue_matrix.at[col1, col2] = np.nan
+
+    return corr_matrix, pvalue_matrix
+
+
+def update_heatmap(df_all, selected_loan_asset, rolling_window, selected_markets):
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    if selected_loan_asset and rolling_window and selected_markets:
+        filtered_df = df_all[(df_all['loan_asset'] == selected_loan_asset) & (
+            df_all['market'].isin(selected_markets))]
+        aggregated_df = filtered_df.groupby(['date', 'market'], observed=True)[
+            dict_borrow_rate_type[rolling_window]].mean().reset_index()
+        pivot_df = aggregated_df.pivot(
+            index='date', columns='market', values=dict_borrow_rate_type[rolling_window])
+        pivot_df = pivot_df.fillna(method='ffill')
+
+        correlation_matrix, pvalue_matrix = pairwise_corr_with_pvalues(
+            pivot_df)
+
+        # Create a combined matrix of correlation and p-values as strings
+        combined_matrix = correlation_matrix.astype(str)
+
+        fig = px.imshow(
+            correlation_matrix.astype(float),
+            text_auto=True,
+            aspect="auto",
+            color_continuous_scale=px.colors.sequential.RdBu[::-1],
+            zmin=-1,
+            zmax=1
+        )
+
+        # Update annotations with combined values
+        fig.update_traces(
+            text=combined_matrix.values,
+            texttemplate="%{text}",
+            hovertemplate="%{text}<extra></extra>"
+        )
+
+        fig.update_layout(
+            title=f'{rolling_window.replace("_", " ").title()} Correlation Heatmap for {selected_loan_asset}')
+    else:
+        fig = go.Figure()
+        fig.update_layout(
+            title='Select a loan asset, rate type, and markets to see the correlation heatmap')
+
+    return fig